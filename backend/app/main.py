@@ -1,7 +1,11 @@
 from fastapi import FastAPI, HTTPException, Depends, status
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.middleware.gzip import GZipMiddleware
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 import os
+import sys
+from contextlib import asynccontextmanager
+import anyio.to_thread
 from dotenv import load_dotenv
 import uvicorn
 
@@ -11,20 +15,33 @@ load_dotenv()
 # Import API routers
 from app.api import auth, embeddings, debate
 
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Sync (def) routes and blocking SDK calls run in AnyIO's threadpool,
+    # which defaults to 40 threads; raise it so they don't queue under load
+    limiter = anyio.to_thread.current_default_thread_limiter()
+    limiter.total_tokens = int(os.getenv("THREADPOOL_LIMIT", "100"))
+    yield
+
 app = FastAPI(
     title="DebateCraft API",
     description="API for DebateCraft application with Pinecone integration",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan
 )
 
+# Compress larger JSON responses
+app.add_middleware(GZipMiddleware, minimum_size=1024)
+
 # CORS middleware
 app.add_middleware(
     CORSMiddleware,
     allow_origins=[
         "http://localhost:8080",  # Frontend dev server
         "http://localhost:3000",  # Alternative frontend port
-        "https://*.lovable.dev",   # Lovable production domains
     ],
+    # Lovable production domains (allow_origins does not expand wildcards)
+    allow_origin_regex=r"https://([a-z0-9-]+\.)+lovable\.dev",
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
@@ -44,4 +61,12 @@ async def health_check():
     return {"status": "healthy", "version": "1.0.0"}
 
 if __name__ == "__main__":
-    uvicorn.run(app, host="0.0.0.0", port=8000)
+    # Multiple workers need the app as an import string; run from backend/
+    uvicorn.run(
+        "app.main:app",
+        host="0.0.0.0",
+        port=8000,
+        workers=int(os.getenv("UVICORN_WORKERS", os.cpu_count() or 1)),
+        loop="uvloop" if sys.platform != "win32" else "asyncio",  # uvloop has no Windows support
+        http="httptools",
+    )
@@ -1,12 +1,14 @@
 # embeddings.py
 import os
-import json
-import time
+import orjson
+import asyncio
 from pathlib import Path
 from dotenv import load_dotenv
 from tqdm import tqdm
 from google import genai
 from google.genai import types
+from aiolimiter import AsyncLimiter
+from tenacity import AsyncRetrying, stop_after_attempt, wait_random_exponential
 
 load_dotenv()
 
@@ -41,53 +43,127 @@ if INPUT_JSON is None:
         print(" -", str(c))
     raise FileNotFoundError("Could not find summaries_all.json")
 
-OUTPUT_JSON = INPUT_JSON.parent / "summaries_with_embeddings.json"
-BATCH_SIZE = 40
+OUTPUT_JSON = INPUT_JSON.parent / "summaries_with_embeddings.jsonl"
+BATCH_SIZE = 100  # Gemini's per-call cap for batch embedding
 EMBEDDING_MODEL = "gemini-embedding-001"
+# gemini-embedding-001 can truncate its 3072-dim output (e.g. to 1536 or 768);
+# smaller vectors shrink the Pinecone index and upload size proportionally.
+# The index dimension and any query-time embedding must use the same value.
+EMBEDDING_DIM = int(os.getenv("GEMINI_EMBEDDING_DIM", "3072"))
+MAX_CONCURRENCY = int(os.getenv("EMBED_CONCURRENCY", "8"))
+EMBED_QPM = int(os.getenv("EMBED_QPM", "100"))  # embedding requests per minute allowed by the account
+# Enough attempts for the jittered backoff to outlast a per-minute quota window
+MAX_RETRIES = 6
+
+# Token bucket shared by every batch, so concurrent batches stay under the quota
+LIMITER = AsyncLimiter(EMBED_QPM, 60)
 
 print(f"Using input file: {INPUT_JSON}")
 
 # Load input JSON
-with open(INPUT_JSON, "r", encoding="utf-8") as f:
-    sources = json.load(f)
+with open(INPUT_JSON, "rb") as f:
+    sources = orjson.loads(f.read())
 
 # Filter out sources with neither summary nor abstract
 sources = [
     s for s in sources if (s.get("summary") or s.get("abstract"))
 ]
 
+def source_key(src):
+    return str(src.get("id") or src.get("paper_id") or "")
+
+# Resume: skip sources already written by a previous (possibly interrupted) run
+done_ids = set()
+if OUTPUT_JSON.exists():
+    complete_bytes = 0  # end of the last newline-terminated line
+    with open(OUTPUT_JSON, "rb") as f:
+        for line in f:
+            if line.endswith(b"\n"):
+                complete_bytes += len(line)
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                done_ids.add(source_key(orjson.loads(line)))
+            except orjson.JSONDecodeError:
+                # Partial last line from a crash; the source will be re-embedded
+                continue
+    # Cut the partial line off so new records don't get appended onto it
+    if complete_bytes < OUTPUT_JSON.stat().st_size:
+        with open(OUTPUT_JSON, "r+b") as f:
+            f.truncate(complete_bytes)
+    done_ids.discard("")
+    sources = [s for s in sources if source_key(s) not in done_ids]
+    print(f"Resuming: {len(done_ids)} sources already embedded")
+
 print(f"Total sources to embed: {len(sources)}")
 
-# Process in batches
-all_embedded = []
-for i in tqdm(range(0, len(sources), BATCH_SIZE)):
-    batch = sources[i:i+BATCH_SIZE]
+async def embed_batch(i, batch, sem, pbar, out):
+    """Embed one batch of sources, retrying with backoff on failure."""
     texts_to_embed = [
         s.get("summary") or s.get("abstract") for s in batch
     ]
 
-    # Call Gemini embedding
-    try:
-        result = client.models.embed_content(
-            model=EMBEDDING_MODEL,
-            contents=texts_to_embed
-        )
-        embeddings_objs = result.embeddings  # list of embedding objects
-
-        # Attach embeddings to corresponding source
-        for src, emb_obj in zip(batch, embeddings_objs):
-            src["embedding"] = emb_obj.values  # full-dim embedding vector
-            all_embedded.append(src)
-
-    except Exception as e:
-        print(f" Error embedding batch {i}-{i+BATCH_SIZE}: {e}")
-        continue
-
-    # Optional: small delay to avoid rate limits
-    time.sleep(0.2)
-
-# Save output JSON
-with open(OUTPUT_JSON, "w", encoding="utf-8") as f:
-    json.dump(all_embedded, f, indent=2, ensure_ascii=False)
-
-print(f" Embeddings complete. Saved {len(all_embedded)} sources to {OUTPUT_JSON}")
\ No newline at end of file
+    def log_retry(retry_state):
+        # A failure in this hook would end the retries instead of being logged
+        try:
+            exc = retry_state.outcome.exception()
+            message = (str(exc).splitlines() or [type(exc).__name__])[0]
+            print(f" Retrying batch {i}-{i+BATCH_SIZE} (attempt {retry_state.attempt_number}/{MAX_RETRIES}) "
+                  f"in {retry_state.next_action.sleep:.1f}s: {message}")
+        except Exception:
+            pass
+
+    # Randomized exponential backoff keeps concurrent batches from retrying
+    # in lockstep after a burst of 429s
+    retrying = AsyncRetrying(
+        stop=stop_after_attempt(MAX_RETRIES),
+        wait=wait_random_exponential(multiplier=1, max=60),
+        before_sleep=log_retry,
+        reraise=True,
+    )
+    async with sem:
+        try:
+            async for attempt in retrying:
+                with attempt:
+                    async with LIMITER:
+                        # Call Gemini embedding
+                        result = await client.aio.models.embed_content(
+                            model=EMBEDDING_MODEL,
+                            contents=texts_to_embed,
+                            config=types.EmbedContentConfig(output_dimensionality=EMBEDDING_DIM)
+                        )
+        except Exception:
+            pbar.update(1)
+            raise
+
+    embeddings_objs = result.embeddings  # list of embedding objects
+
+    # Attach embeddings and append each record as soon as its batch completes
+    for src, emb_obj in zip(batch, embeddings_objs):
+        src["embedding"] = emb_obj.values  # full-dim embedding vector
+        out.write(orjson.dumps(src, option=orjson.OPT_APPEND_NEWLINE))
+    out.flush()
+
+    pbar.update(1)
+    return len(batch)
+
+async def main():
+    # Keep up to MAX_CONCURRENCY batches in flight at once
+    sem = asyncio.Semaphore(MAX_CONCURRENCY)
+    starts = range(0, len(sources), BATCH_SIZE)
+
+    with open(OUTPUT_JSON, "ab") as out, tqdm(total=len(starts)) as pbar:
+        tasks = [embed_batch(i, sources[i:i+BATCH_SIZE], sem, pbar, out) for i in starts]
+        results = await asyncio.gather(*tasks, return_exceptions=True)
+
+    embedded_count = 0
+    for i, res in zip(starts, results):
+        if isinstance(res, Exception):
+            print(f" Error embedding batch {i}-{i+BATCH_SIZE}: {res}")
+            continue
+        embedded_count += res
+
+    print(f" Embeddings complete. Saved {embedded_count} sources to {OUTPUT_JSON}")
+
+asyncio.run(main())
@@ -1,17 +1,30 @@
-import requests
+import asyncio
+import ahocorasick
+import httpx
 import os
-import time
-import json
+import orjson
 import re
+import xxhash
 from dotenv import load_dotenv
 from collections import defaultdict, Counter
 from datetime import datetime
+from tenacity import (
+    retry,
+    retry_if_exception,
+    stop_after_attempt,
+    wait_exponential_jitter,
+)
 
 load_dotenv()
 
 api_key = os.getenv('CORE_API_KEY')
 headers = {"Authorization": f"Bearer {api_key}"}
 
+CORE_BASE_URL = "https://api.core.ac.uk/v3"
+MAX_IN_FLIGHT = 8    # concurrent requests allowed against the CORE API
+PAGE_SIZE = 50
+MAX_OFFSET = 1000
+
 # Focused academic fields for debate topics
 academic_fields = {
     "history": {
@@ -41,54 +54,100 @@ academic_fields = {
     }
 }
 
-def detect_field_from_content(paper, academic_fields):
-    """Intelligently detect field from paper content with proper existence checks"""
-    title = paper.get('title', '').lower()
-    
-    # Check if abstract exists and get it
-    abstract = ''
-    if paper.get('abstract') is not None:
-        abstract = paper.get('abstract', '').lower()
+FULLTEXT_SCAN_LIMIT = 50_000  # leading characters of full text considered for field detection
+FULLTEXT_EDGE_CHARS = 1500  # characters kept from each end of the body; process_sources prompts with both ends
+
+# Back matter starts at a heading on its own line, in the second half of the body
+BACK_MATTER_RE = re.compile(r"^[ \t]*(References|Bibliography|Acknowledg(e)?ments)[ \t]*:?[ \t]*$", re.M | re.I)
+WHITESPACE_RE = re.compile(r"\s+")
+
+def build_keyword_automaton(config_key):
+    """Build an Aho-Corasick automaton mapping each keyword to the fields that list it"""
+    keyword_fields = defaultdict(list)
+    for field_name, field_config in academic_fields.items():
+        for keyword in field_config[config_key]:
+            keyword_fields[keyword].append(field_name)
     
-    # Check if fulltext exists and get it
-    fulltext = ''
-    if paper.get('fullText') is not None:
-        fulltext = paper.get('fullText', '').lower()
+    automaton = ahocorasick.Automaton()
+    for keyword, fields in keyword_fields.items():
+        automaton.add_word(keyword, (keyword, tuple(fields)))
+    automaton.make_automaton()
+    return automaton
+
+# Built once at import so each text is scanned in a single pass
+keyword_automaton = build_keyword_automaton("keywords")
+title_automaton = build_keyword_automaton("title_keywords")
+fulltext_automaton = build_keyword_automaton("fulltext_keywords")
+
+def score_keyword_hits(automaton, text, weight, field_scores):
+    """Add weight to each field once per distinct keyword found in text"""
+    matched = set()
+    hits = Counter()
+    for _, (keyword, fields) in automaton.iter(text):
+        if keyword in matched:
+            continue
+        matched.add(keyword)
+        hits.update(fields)
     
-    # Handle fieldOfStudy safely
-    field_of_study = paper.get('fieldOfStudy')
-    if field_of_study is None:
-        field_of_study = ''
-    else:
-        field_of_study = str(field_of_study).lower()
+    # Apply in academic_fields order so ties resolve the same way as before
+    for field_name in academic_fields:
+        if field_name in hits:
+            field_scores[field_name] += weight * hits[field_name]
+
+# Detected field per paper_id; it depends only on the paper, so it is reused
+# when the same paper comes back for another keyword or field
+detected_field_cache = {}
+
+def add_lowercase_text(paper):
+    """Case-fold the text fields once and keep them on the raw API record"""
+    paper['_title_lc'] = (paper.get('title') or '').lower()
+    paper['_abstract_lc'] = (paper.get('abstract') or '').lower()
+    paper['_fulltext_lc'] = (paper.get('fullText') or '')[:FULLTEXT_SCAN_LIMIT].lower()
+    paper['_field_of_study_lc'] = str(paper.get('fieldOfStudy') or '').lower()
+
+def fulltext_edges(full_text):
+    """Head and tail of the body, without back matter and with whitespace collapsed.
+
+    Matches what process_sources does to a full body before prompting, so only
+    the parts it uses are persisted; the tail is empty when the body is short
+    enough to be sent whole.
+    """
+    match = BACK_MATTER_RE.search(full_text, len(full_text) // 2)
+    if match:
+        full_text = full_text[:match.start()]
+    body = WHITESPACE_RE.sub(" ", full_text).strip()
+    if len(body) <= 2 * FULLTEXT_EDGE_CHARS:
+        return body, ''
+    return body[:FULLTEXT_EDGE_CHARS], body[-FULLTEXT_EDGE_CHARS:]
+
+def detect_field_from_content(paper, academic_fields):
+    """Intelligently detect field from paper content (expects add_lowercase_text to have run)"""
+    title = paper['_title_lc']
+    abstract = paper['_abstract_lc']
+    fulltext = paper['_fulltext_lc']
+    field_of_study = paper['_field_of_study_lc']
     
     field_scores = defaultdict(int)
     
-    # Score based on fieldOfStudy
+    # Score based on fieldOfStudy (once per field, however many keywords match)
     if field_of_study:
-        for field_name, field_config in academic_fields.items():
-            if any(keyword in field_of_study for keyword in field_config["keywords"]):
+        matched_fields = {field_name
+                          for _, (_, fields) in keyword_automaton.iter(field_of_study)
+                          for field_name in fields}
+        for field_name in academic_fields:
+            if field_name in matched_fields:
                 field_scores[field_name] += 5
     
     # Score based on title keywords
-    for field_name, field_config in academic_fields.items():
-        for keyword in field_config["title_keywords"]:
-            if keyword in title:
-                field_scores[field_name] += 3
+    score_keyword_hits(title_automaton, title, 3, field_scores)
     
     # Score based on abstract keywords (only if abstract exists)
     if abstract:
-        for field_name, field_config in academic_fields.items():
-            for keyword in field_config["keywords"]:
-                if keyword in abstract:
-                    field_scores[field_name] += 2
+        score_keyword_hits(keyword_automaton, abstract, 2, field_scores)
     
     # Score based on fulltext keywords (only if fulltext exists)
     if fulltext:
-        for field_name, field_config in academic_fields.items():
-            for keyword in field_config["fulltext_keywords"]:
-                if keyword in fulltext:
-                    field_scores[field_name] += 1
+        score_keyword_hits(fulltext_automaton, fulltext, 1, field_scores)
     
     # Return the field with highest score, or None if no clear match
     if field_scores:
@@ -114,12 +173,63 @@ def create_paper_id(paper):
     if paper.get('authors') and len(paper['authors']) > 0:
         first_author = paper['authors'][0].get('name', '').lower().strip()
     
-    # Create a simple hash
-    import hashlib
+    # Create a simple (non-cryptographic) hash
     content = f"{title}|{first_author}"
-    return f"hash_{hashlib.md5(content.encode()).hexdigest()[:16]}"
+    return f"hash_{xxhash.xxh64(content.encode()).hexdigest()}"
+
+class RetryAfterError(httpx.HTTPStatusError):
+    """429 from the CORE API; carries the server's Retry-After hint"""
 
-def collect_sources_for_field(field_name, field_config, target_count=500):
+def is_retryable(exc):
+    """Retry transport failures, rate limits and server errors, not other 4xx"""
+    if isinstance(exc, httpx.TransportError):
+        return True
+    if isinstance(exc, httpx.HTTPStatusError):
+        return exc.response.status_code == 429 or exc.response.status_code >= 500
+    return False
+
+def wait_for_header(fallback):
+    """Honour Retry-After on 429s, otherwise defer to the fallback wait strategy"""
+    def wait(retry_state):
+        exc = retry_state.outcome.exception()
+        if isinstance(exc, RetryAfterError):
+            retry_after = exc.response.headers.get("Retry-After", "")
+            if retry_after.isdigit():
+                return float(retry_after)
+        return fallback(retry_state)
+    return wait
+
+def first_line(exc: BaseException) -> str:
+    """First line of an exception's message, or its type name when the message is empty (e.g. timeouts)"""
+    return (str(exc).splitlines() or [type(exc).__name__])[0]
+
+def log_retry(retry_state):
+    # A failure in this hook would escape fetch_page instead of being retried
+    try:
+        exc = retry_state.outcome.exception()
+        print(f"      {first_line(exc)} (attempt {retry_state.attempt_number}), retrying in {retry_state.next_action.sleep:.1f} seconds...")
+    except Exception:
+        pass
+
+@retry(stop=stop_after_attempt(5),
+       wait=wait_for_header(wait_exponential_jitter(initial=1, max=60)),
+       retry=retry_if_exception(is_retryable),
+       before_sleep=log_retry,
+       reraise=True)
+async def fetch_page(client, keyword, offset):
+    """Fetch one page of search results for a keyword"""
+    response = await client.post("/search/works", json={
+        "q": keyword,  # Use the keyword directly
+        "limit": PAGE_SIZE,
+        "offset": offset,
+        "scroll": False
+    })
+    if response.status_code == 429:
+        raise RetryAfterError("Rate limit hit", request=response.request, response=response)
+    response.raise_for_status()
+    return response.json().get('results', [])
+
+async def collect_sources_for_field(client, sem, field_name, field_config, target_count=500):
     """Collect sources with equal distribution across individual keywords"""
     print(f"\n🔍 Collecting sources for: {field_name}")
     
@@ -130,111 +240,106 @@ def collect_sources_for_field(field_name, field_config, target_count=500):
     print(f"   Target: {papers_per_keyword} papers per keyword")
     
     collected = []
+    # Shared across tasks; safe without a lock since everything runs on one event loop
     seen_paper_ids = set()
+    keyword_collected = Counter()
+    keyword_exhausted_at = {}
     total_checked = 0
     duplicates_found = 0
     
-    # Collect papers for each individual keyword
-    for i, keyword in enumerate(keywords):
-        print(f"   Keyword {i+1}/{len(keywords)}: '{keyword}' (target: {papers_per_keyword})")
+    async def collect_page(keyword, offset):
+        nonlocal total_checked, duplicates_found
         
-        keyword_collected = 0
-        offset = 0
-        batch_size = 50
+        async with sem:
+            # Skip pages for keywords that are already full or have run out of results
+            if (keyword_collected[keyword] >= papers_per_keyword or
+                offset >= keyword_exhausted_at.get(keyword, MAX_OFFSET)):
+                return
+            try:
+                results = await fetch_page(client, keyword, offset)
+            except httpx.HTTPError as e:
+                print(f"      Failed '{keyword}' at offset {offset}: {e}")
+                return
         
-        while keyword_collected < papers_per_keyword and offset < 1000:
-            max_retries = 3
-            retry_count = 0
+        if not results:
+            keyword_exhausted_at[keyword] = min(offset, keyword_exhausted_at.get(keyword, MAX_OFFSET))
+            return
+        
+        total_checked += len(results)
+        batch_new = 0
+        batch_duplicates = 0
+        collected_at = datetime.now().isoformat()
+        
+        for paper in results:
+            if keyword_collected[keyword] >= papers_per_keyword:
+                break
+            
+            paper_id = create_paper_id(paper)
+            
+            if paper_id in seen_paper_ids:
+                batch_duplicates += 1
+                continue
+            # Acceptance depends only on the paper and field, so a repeat would get the same verdict
+            seen_paper_ids.add(paper_id)
+            
+            paper_field = str(paper.get('fieldOfStudy') or '').lower()
+            labelled = field_name in paper_field or any(kw in paper_field for kw in keywords)
             
-            while retry_count < max_retries:
-                response = requests.post("https://api.core.ac.uk/v3/search/works", 
-                                       headers=headers, 
-                                       json={
-                                           "q": keyword,  # Use the keyword directly
-                                           "limit": batch_size,
-                                           "offset": offset,
-                                           "scroll": False
-                                       })
-                
-                if response.status_code == 200:
-                    data = response.json()
-                    results = data.get('results', [])
-                    
-                    if not results:
-                        break
-                    
-                    total_checked += len(results)
-                    batch_new = 0
-                    batch_duplicates = 0
-                    
-                    for paper in results:
-                        if keyword_collected >= papers_per_keyword:
-                            break
-                        
-                        paper_id = create_paper_id(paper)
-                        
-                        if paper_id in seen_paper_ids:
-                            batch_duplicates += 1
-                            continue
-                        
-                        detected_field = detect_field_from_content(paper, academic_fields)
-                        paper_field = str(paper.get('fieldOfStudy') or '').lower()                        
-                        if (field_name in paper_field or 
-                            detected_field == field_name or
-                            any(kw in paper_field for kw in keywords)):
-                            
-                            seen_paper_ids.add(paper_id)
-                            paper_data = {
-                                'id': paper.get('id'),
-                                'paper_id': paper_id,
-                                'title': paper.get('title', ''),
-                                'abstract': paper.get('abstract', ''),
-                                'hasAbstract': paper.get('abstract') is not None,
-                                'authors': [author.get('name', '') for author in paper.get('authors', [])],
-                                'yearPublished': paper.get('yearPublished'),
-                                'citationCount': paper.get('citationCount', 0),
-                                'doi': paper.get('doi', ''),
-                                'publisher': paper.get('publisher', ''),
-                                'documentType': paper.get('documentType', ''),
-                                'fieldOfStudy': paper.get('fieldOfStudy', ''),
-                                'detectedField': detected_field,
-                                'downloadUrl': paper.get('downloadUrl', ''),
-                                'fullText': paper.get('fullText', ''),
-                                'hasFullText': paper.get('fullText') is not None,
-                                'searchStrategy': f"Direct keyword: {keyword}",
-                                'keywordUsed': keyword,  # Track the specific keyword
-                                'collectedAt': datetime.now().isoformat()
-                            }
-                            collected.append(paper_data)
-                            keyword_collected += 1
-                            batch_new += 1
-                    
-                    duplicates_found += batch_duplicates
-                    print(f"     Found {batch_new} new papers, {batch_duplicates} duplicates (keyword total: {keyword_collected}, overall: {len(collected)})")
-                    break
-                    
-                elif response.status_code == 500:
-                    retry_count += 1
-                    print(f"      Server error 500 (attempt {retry_count}/{max_retries}), retrying in 5 seconds...")
-                    time.sleep(5)
-                    continue
-                    
-                elif response.status_code == 429:
-                    print(f"      Rate limit hit, waiting 60 seconds...")
-                    time.sleep(60)
-                    continue
-                else:
-                    print(f"      Error {response.status_code}: {response.text[:200]}")
-                    break
-                
-                if retry_count >= max_retries:
-                    print(f"      Failed after {max_retries} retries, moving to next keyword")
-                    break
+            # Papers the API already labels with this field skip the content scan;
+            # the field is then known without detection
+            if labelled:
+                detected_field = field_name
+            elif paper_id in detected_field_cache:
+                detected_field = detected_field_cache[paper_id]
+            else:
+                add_lowercase_text(paper)
+                detected_field = detect_field_from_content(paper, academic_fields)
+                detected_field_cache[paper_id] = detected_field
             
-            offset += batch_size
-            time.sleep(2)
+            if not (labelled or detected_field == field_name):
+                continue
+            
+            fulltext_head, fulltext_tail = fulltext_edges(paper.get('fullText') or '')
+            paper_data = {
+                'id': paper.get('id'),
+                'paper_id': paper_id,
+                'title': paper.get('title', ''),
+                'abstract': paper.get('abstract', ''),
+                'hasAbstract': paper.get('abstract') is not None,
+                'authors': [author.get('name', '') for author in paper.get('authors', [])],
+                'yearPublished': paper.get('yearPublished'),
+                'citationCount': paper.get('citationCount', 0),
+                'doi': paper.get('doi', ''),
+                'publisher': paper.get('publisher', ''),
+                'documentType': paper.get('documentType', ''),
+                'fieldOfStudy': paper.get('fieldOfStudy', ''),
+                'detectedField': detected_field,
+                'downloadUrl': paper.get('downloadUrl', ''),
+                # Full bodies dominate file size; keep only the two ends used for summarization
+                'fulltext_head': fulltext_head,
+                'fulltext_tail': fulltext_tail,
+                'hasFullText': paper.get('fullText') is not None,
+                'searchStrategy': f"Direct keyword: {keyword}",
+                'keywordUsed': keyword,  # Track the specific keyword
+                'collectedAt': collected_at
+            }
+            collected.append(paper_data)
+            keyword_collected[keyword] += 1
+            batch_new += 1
         
-        print(f"    Keyword '{keyword}' complete: {keyword_collected} papers")
+        duplicates_found += batch_duplicates
+        print(f"     '{keyword}' offset {offset}: {batch_new} new papers, {batch_duplicates} duplicates (keyword total: {keyword_collected[keyword]}, overall: {len(collected)})")
+    
+    # Fan out every (keyword, page) pair; the semaphore bounds how many are in flight
+    tasks = [
+        collect_page(keyword, offset)
+        for offset in range(0, MAX_OFFSET, PAGE_SIZE)
+        for keyword in keywords
+    ]
+    await asyncio.gather(*tasks)
+    
+    for keyword in keywords:
+        print(f"    Keyword '{keyword}' complete: {keyword_collected[keyword]} papers")
     
     print(f"    Collected {len(collected)} unique papers for {field_name}")
     print(f"    Duplicates prevented: {duplicates_found}")
@@ -275,12 +380,20 @@ def analyze_keyword_distribution(collected_sources):
 
 def save_sources_to_file(sources, filename="debate_sources.json"):
     """Save collected sources to JSON file"""
-    with open(filename, 'w', encoding='utf-8') as f:
-        json.dump(sources, f, indent=2, ensure_ascii=False)
+    with open(filename, 'wb') as f:
+        f.write(orjson.dumps(sources, option=orjson.OPT_INDENT_2))
     
     print(f" Saved {sum(len(papers) for papers in sources.values())} sources to {filename}")
 
-def main():
+def save_field_sources(field_name, papers):
+    """Save one field's sources to its own file (debate_sources.{field}.json)"""
+    filename = f"debate_sources.{field_name}.json"
+    with open(filename, 'wb') as f:
+        f.write(orjson.dumps(papers, option=orjson.OPT_INDENT_2))
+    
+    print(f" Saved {len(papers)} {field_name} sources to {filename}")
+
+async def main():
     """Main collection process"""
     print(" Starting debate source collection...")
     print(" Target disciplines: history, english, politics, business, science")
@@ -288,16 +401,21 @@ def main():
     print(" Equal distribution: ~83 papers per keyword")
     
     collected_sources = {}
+    sem = asyncio.Semaphore(MAX_IN_FLIGHT)
     
-    # Collect sources for each field
-    for field_name, field_config in academic_fields.items():
-        new_sources = collect_sources_for_field(field_name, field_config, target_count=500)
-        collected_sources[field_name] = new_sources
-        
-        # Save after each field
-        save_sources_to_file(collected_sources)
+    async with httpx.AsyncClient(base_url=CORE_BASE_URL,
+                                 headers=headers,
+                                 timeout=30,
+                                 limits=httpx.Limits(max_connections=20)) as client:
+        # Collect sources for each field
+        for field_name, field_config in academic_fields.items():
+            new_sources = await collect_sources_for_field(client, sem, field_name, field_config, target_count=500)
+            collected_sources[field_name] = new_sources
+            
+            # Save each field on its own so earlier fields are never rewritten
+            save_field_sources(field_name, new_sources)
     
-    # Final save and summary
+    # Merge all fields into debate_sources.json once, for process_sources.py
     save_sources_to_file(collected_sources)
     
     print(f"\n🎉 Collection complete!")
@@ -322,10 +440,10 @@ def main():
         "equal_keyword_distribution": "enabled"
     }
     
-    with open("debate_collection_summary.json", 'w') as f:
-        json.dump(summary, f, indent=2)
+    with open("debate_collection_summary.json", 'wb') as f:
+        f.write(orjson.dumps(summary, option=orjson.OPT_INDENT_2))
     
     print(f" Summary saved to debate_collection_summary.json")
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    asyncio.run(main())
\ No newline at end of file
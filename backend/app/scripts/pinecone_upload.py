@@ -1,7 +1,10 @@
 # pinecone_upload.py
 import os
-import json
-import time
+import orjson
+import ijson
+import numpy as np
+from collections import deque
+from itertools import chain
 from pathlib import Path
 from dotenv import load_dotenv
 from tqdm import tqdm
@@ -17,6 +20,7 @@ load_dotenv()
 PINECONE_API_KEY = os.getenv("PINECONE_API_KEY")
 INDEX_NAME = os.getenv("INDEX_NAME", "debatecraft-index")
 BATCH_SIZE = int(os.getenv("PINECONE_BATCH_SIZE", "100"))
+UPSERT_WINDOW = int(os.getenv("PINECONE_UPSERT_WINDOW", "8"))  # batches in flight at once
 
 if not PINECONE_API_KEY:
     raise RuntimeError("PINECONE_API_KEY not set in environment/.env")
@@ -28,7 +32,11 @@ BASE_DIR = Path(__file__).resolve().parent
 APP_DIR = BASE_DIR.parent
 PROJECT_ROOT = APP_DIR.parent
 
+# embeddings.py writes JSONL; the legacy single-array JSON is still accepted
 candidates = [
+    APP_DIR / "summaries_with_embeddings.jsonl",
+    PROJECT_ROOT / "summaries_with_embeddings.jsonl",
+    BASE_DIR / "summaries_with_embeddings.jsonl",
     APP_DIR / "summaries_with_embeddings.json",
     PROJECT_ROOT / "summaries_with_embeddings.json",
     BASE_DIR / "summaries_with_embeddings.json",
@@ -39,30 +47,57 @@ if EMBEDDED_JSON is None:
     print("Tried paths:")
     for c in candidates:
         print(" -", c)
-    raise FileNotFoundError("Could not find summaries_with_embeddings.json")
+    raise FileNotFoundError("Could not find summaries_with_embeddings.jsonl")
 
 print("Using embedded JSON:", EMBEDDED_JSON)
 
-with open(EMBEDDED_JSON, "r", encoding="utf-8") as f:
-    sources = json.load(f)
+def iter_records(path):
+    """Yield records one at a time so the whole file is never held in memory."""
+    with open(path, "rb") as f:
+        if path.suffix == ".jsonl":
+            for line_no, line in enumerate(f, 1):
+                if not line.strip():
+                    continue
+                try:
+                    yield orjson.loads(line)
+                except orjson.JSONDecodeError as e:
+                    # e.g. a line cut short by an interrupted embeddings run
+                    print(f"⚠️ Skipping malformed line {line_no} in {path.name}: {e}")
+        else:
+            yield from ijson.items(f, "item", use_float=True)
 
-print(f"Loaded {len(sources)} records")
+def get_vector(record):
+    return record.get("embedding") or record.get("vector") or record.get("values")
+
+def pop_vector(record):
+    """Remove the vector from the record so only the float32 copy stays alive."""
+    vec = get_vector(record)
+    for key in ("embedding", "vector", "values"):
+        record.pop(key, None)
+    return vec
+
+records = iter_records(EMBEDDED_JSON)
+first_record = next(records, None)
+if first_record is None:
+    raise RuntimeError(f"No records found in {EMBEDDED_JSON}")
 
 # ----------------------
 # Infer embedding dimension
 # ----------------------
-def infer_embedding_dim(records):
-    for r in records:
-        v = r.get("embedding") or r.get("vector") or r.get("values")
-        if isinstance(v, list) and len(v) > 0:
-            return len(v)
+def infer_embedding_dim(record):
+    v = get_vector(record)
+    if isinstance(v, list) and len(v) > 0:
+        return len(v)
     return None
 
-EMBEDDING_DIM = infer_embedding_dim(sources)
+EMBEDDING_DIM = infer_embedding_dim(first_record)
 if EMBEDDING_DIM is None:
-    raise RuntimeError("Could not infer embedding dimension from data.")
+    raise RuntimeError("Could not infer embedding dimension from the first record.")
 print("Inferred embedding dim:", EMBEDDING_DIM)
 
+# Kept aside for the sanity query; the record's own list is dropped during upload
+sample_vec = np.asarray(get_vector(first_record), dtype=np.float32)
+
 # ----------------------
 # Pinecone client + index
 # ----------------------
@@ -85,131 +120,136 @@ except Exception as e:
     print("Then re-run this script.")
     # Don't abort yet; attempt to continue (pc.Index will fail later if index missing)
 
-index = pc.Index(INDEX_NAME)
+# pool_threads sizes the SDK's thread pool used for async_req upserts
+index = pc.Index(INDEX_NAME, pool_threads=UPSERT_WINDOW)
 
 # ----------------------
-# Metadata sanitization helpers
+# Metadata schema
 # ----------------------
-def sanitize_value(v):
-    """Convert v into an allowed Pinecone metadata value:
-       - string, number, boolean, or list of strings
-    """
-    # Handle None
+# Pinecone metadata values must be strings, numbers, booleans or lists of
+# strings. Every key has a fixed converter, so no per-value type dispatch.
+def as_str(v):
+    return "" if v is None else str(v)
+
+def as_num(v):
+    return "" if v is None else v
+
+def as_str_list(v):
     if v is None:
-        return ""  # replace None/null with empty string
-
-    # Primitive accepted types: bool, int, float, str
-    if isinstance(v, (bool, int, float, str)):
-        # ensure booleans remain booleans, numbers remain numbers, strings remain strings
-        return v
-
-    # If it's a list/tuple -> convert each element to string (filter None)
-    if isinstance(v, (list, tuple)):
-        sanitized = []
-        for el in v:
-            if el is None:
-                continue
-            # if element is primitive number/bool/string, keep, else convert to str
-            if isinstance(el, (bool, int, float, str)):
-                sanitized.append(str(el) if not isinstance(el, str) else el)
-            else:
-                sanitized.append(json.dumps(el, ensure_ascii=False))
-        return sanitized
-
-    # For dicts or other objects -> convert to a JSON string
-    try:
-        return json.dumps(v, ensure_ascii=False)
-    except Exception:
-        return str(v)
-
-def sanitize_metadata(raw_meta: dict) -> dict:
-    """Return a metadata dict with only allowed value types."""
-    sanitized = {}
-    for k, v in (raw_meta or {}).items():
-        try:
-            sv = sanitize_value(v)
-            # Pinecone requires metadata keys to be strings, values to be allowed types.
-            sanitized[k] = sv
-        except Exception as e:
-            # Fallback to string representation
-            sanitized[k] = str(v)
-    return sanitized
+        return ""
+    return [str(el) for el in v if el is not None]
+
+# (metadata key, record key, converter)
+META_SCHEMA = [
+    ("title", "title", as_str),
+    ("summary", "summary", as_str),
+    ("fieldOfStudy", "fieldOfStudy", as_str),
+    ("paper_id", "paper_id", as_str),
+    ("yearPublished", "yearPublished", as_num),
+    ("doi", "doi", as_str),
+    ("publisher", "publisher", as_str),
+    ("citationCount", "citationCount", as_num),
+    ("authors", "authors", as_str_list),
+    ("keywordUsed", "keywordUsed", as_str),
+    ("detectedField", "detectedField", as_str),
+    ("searchStrategy", "searchStrategy", as_str),
+]
 
 # ----------------------
 # Upsert helpers
 # ----------------------
 def build_metadata(record):
-    """Pick fields to store in metadata and sanitize them."""
-    meta = {
-        "title": record.get("title", ""),
-        "summary": record.get("summary", "") or "",
-        "fieldOfStudy": record.get("fieldOfStudy", "") or "",
-        "paper_id": str(record.get("paper_id", "")) if record.get("paper_id") is not None else "",
-        # Optional extra fields (sanitized)
-        "yearPublished": record.get("yearPublished"),
-        "doi": record.get("doi"),
-        "publisher": record.get("publisher"),
-        "citationCount": record.get("citationCount"),
-        "authors": record.get("authors"),
-        "keywordUsed": record.get("keywordUsed"),
-        "detectedField": record.get("detectedField"),
-        "searchStrategy": record.get("searchStrategy"),
-    }
-    return sanitize_metadata(meta)
-
-def upsert_batch(batch, start_idx):
+    """Pick fields to store in metadata, converted to Pinecone-compatible types."""
+    return {key: conv(record.get(src)) for key, src, conv in META_SCHEMA}
+
+def upsert_batch(batch, vectors, start_idx):
+    """Dispatch an upsert without waiting; returns the pending result."""
     tuples = []
-    for offset, rec in enumerate(batch):
+    for offset, (rec, vec) in enumerate(zip(batch, vectors)):
         idx = start_idx + offset
         rec_id = rec.get("id") or rec.get("paper_id") or f"doc_{idx}"
         # ensure string id
         rec_id = str(rec_id)
-        vec = rec.get("embedding") or rec.get("vector") or rec.get("values")
-        if not isinstance(vec, list):
-            raise RuntimeError(f"Missing/invalid embedding for record {rec_id}")
         metadata = build_metadata(rec)
-        tuples.append((rec_id, vec, metadata))
+        # The SDK only accepts plain lists, so convert at the boundary
+        tuples.append((rec_id, vec.tolist(), metadata))
     # Upsert tuples
-    index.upsert(vectors=tuples)
+    return index.upsert(vectors=tuples, async_req=True)
+
+def save_failed_batch(batch, vectors, start_idx):
+    tmp = Path(f"failed_batch_{start_idx}.json")
+    records = [{**rec, "embedding": vec.tolist()} for rec, vec in zip(batch, vectors)]
+    with open(tmp, "wb") as tf:
+        tf.write(orjson.dumps(records, option=orjson.OPT_INDENT_2))
+
+def wait_for_upsert(start_idx, batch, vectors, pending):
+    try:
+        pending.get()
+    except Exception as e:
+        print(f"Error upserting batch starting at {start_idx}: {e}")
+        # Save failing batch for inspection
+        save_failed_batch(batch, vectors, start_idx)
+        raise
 
 # ----------------------
 # Validate and upload
 # ----------------------
-# Validate embeddings roughly
-invalid = []
-for i, r in enumerate(sources):
-    v = r.get("embedding") or r.get("vector") or r.get("values")
+def validate_record(i, rec):
+    v = get_vector(rec)
     if not isinstance(v, list):
-        invalid.append((i, "no embedding"))
-    elif len(v) != EMBEDDING_DIM:
-        invalid.append((i, f"dim {len(v)} != {EMBEDDING_DIM}"))
-if invalid:
-    print(f"Found {len(invalid)} records with invalid embeddings (first 5): {invalid[:5]}")
-    raise RuntimeError("Fix embed shapes before uploading")
-
-total = len(sources)
-print(f"Uploading {total} vectors in batches of {BATCH_SIZE}...")
-
-for i in tqdm(range(0, total, BATCH_SIZE)):
-    batch = sources[i:i + BATCH_SIZE]
+        raise RuntimeError(f"Record {i} has no embedding; fix embed shapes before uploading")
+    if len(v) != EMBEDDING_DIM:
+        raise RuntimeError(f"Record {i} has dim {len(v)} != {EMBEDDING_DIM}; fix embed shapes before uploading")
+
+def new_vector_block(size):
+    return np.empty((size, EMBEDDING_DIM), dtype=np.float32)
+
+def iter_batches(records, size):
+    """Validate records as they stream in and group them into upsert batches.
+
+    Each batch's vectors are packed into one dense float32 matrix rather than
+    kept as per-record lists of Python floats.
+    """
+    batch, vectors = [], new_vector_block(size)
+    for i, rec in enumerate(records):
+        validate_record(i, rec)
+        vectors[len(batch)] = pop_vector(rec)
+        batch.append(rec)
+        if len(batch) == size:
+            yield batch, vectors
+            # Start fresh buffers; in-flight upserts still reference the old ones
+            batch, vectors = [], new_vector_block(size)
+    if batch:
+        yield batch, vectors[:len(batch)]
+
+print(f"Uploading vectors in batches of {BATCH_SIZE}...")
+
+# Sliding window of (start index, batch, vectors, pending upsert)
+in_flight = deque()
+total = 0
+for batch, vectors in tqdm(iter_batches(chain([first_record], records), BATCH_SIZE), unit="batch"):
+    i = total
+    total += len(batch)
     try:
-        upsert_batch(batch, i)
+        pending = upsert_batch(batch, vectors, i)
     except Exception as e:
         print(f"Error upserting batch starting at {i}: {e}")
-        # Save failing batch for inspection
-        tmp = Path(f"failed_batch_{i}.json")
-        with open(tmp, "w", encoding="utf-8") as tf:
-            json.dump(batch, tf, indent=2, ensure_ascii=False)
+        save_failed_batch(batch, vectors, i)
         raise
-    # small pause
-    time.sleep(0.05)
+    in_flight.append((i, batch, vectors, pending))
+    if len(in_flight) >= UPSERT_WINDOW:
+        wait_for_upsert(*in_flight.popleft())
+
+# Drain remaining uploads
+while in_flight:
+    wait_for_upsert(*in_flight.popleft())
 
+print(f"Uploaded {total} vectors")
 print("Upload complete ")
 
 # Optional quick sanity check
 try:
-    sample_vec = sources[0]["embedding"]
-    res = index.query(vector=sample_vec, top_k=3, include_metadata=True)
+    res = index.query(vector=sample_vec.tolist(), top_k=3, include_metadata=True)
     print("Sample query results (raw):")
     print(res)
 except Exception as e:
@@ -1,16 +1,58 @@
 import os
-import json
+import sys
+import mmap
 import time
-import traceback
-from typing import List, Dict, Any
+import queue
+import asyncio
+import hashlib
+import logging
+import argparse
+from logging.handlers import QueueHandler, QueueListener
+from itertools import islice
+from typing import Iterable, Iterator, List, Dict, Any, Optional, Union
 from pathlib import Path
 from dotenv import load_dotenv
 from tqdm import tqdm
-from jsonschema import validate, ValidationError
+import httpx
+import ijson
+import orjson
+import msgspec
+import pyarrow as pa
+import pyarrow.compute as pc
+from jsonschema import Draft7Validator, ValidationError
 from google import genai
+from google.genai import types
+from aiolimiter import AsyncLimiter
+from tenacity import AsyncRetrying, stop_after_attempt, wait_random_exponential
+from diskcache import Cache
+
+if sys.platform != "win32":
+    import uvloop  # no Windows build
 
 BATCH_SIZE = 498
-CHECKPOINT_FILE = "processed_ids.json"
+CHECKPOINT_FILE = "processed_ids.log"  # append-only, one source id per line
+LEGACY_CHECKPOINT_FILE = "processed_ids.json"
+GEMINI_QPM = int(os.getenv("GEMINI_QPM", "60"))  # requests per minute allowed by the account
+MAX_RETRIES = 3
+MAX_CONCURRENCY = int(os.getenv("GEMINI_CONCURRENCY", "16"))  # requests in flight at once
+MARSHAL_SIZE = int(os.getenv("GEMINI_MARSHAL_SIZE", "10"))  # sources summarized per live request
+MAX_MARSHAL_CHARS = 30000  # cap on combined processedText per live request
+OUTPUT_TOKENS_PER_SOURCE = 400
+BATCH_POLL_SECONDS = 30
+CACHE_DIR = os.getenv("GEMINI_CACHE_DIR", "gemini_cache")  # summaries keyed by processedText hash
+JSONL_OPTIONS = orjson.OPT_APPEND_NEWLINE | orjson.OPT_NON_STR_KEYS
+FAILURE_LOG_FILE = "failures.log"
+FAILED_RAW_FILE = "failed_raw_responses.jsonl"
+STREAM_ABORT_REASONS = {"SAFETY", "RECITATION", "BLOCKLIST", "PROHIBITED_CONTENT", "SPII"}
+BATCH_JOB_DONE_STATES = {"JOB_STATE_SUCCEEDED", "JOB_STATE_FAILED", "JOB_STATE_CANCELLED", "JOB_STATE_EXPIRED"}
+PREPROCESS_CHUNK = 256  # sources normalized per vectorized pass
+
+# RE2 patterns for Arrow compute. BACK_MATTER_PATTERN keeps everything before
+# the last back-matter heading on its own line; the heading is matched before
+# whitespace is collapsed so the line anchors still apply
+BACK_MATTER_PATTERN = r"(?is)\A(.*)\n[ \t]*(?:References|Bibliography|Acknowledge?ments)[ \t]*:?[ \t]*(?:\n.*)?\z"
+# Same set as Python's str.isspace(), which RE2's \s doesn't fully cover
+WHITESPACE_PATTERN = r"[\t-\r\x{1c}-\x{20}\x{85}\p{Z}]+"
 
 load_dotenv()
 
@@ -18,8 +60,21 @@ GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
 if not GEMINI_API_KEY:
     raise RuntimeError("GEMINI_API_KEY not set in .env")
 
-client = genai.Client(api_key=GEMINI_API_KEY)
+# One pooled HTTP/2 connection carries all concurrent requests instead of a
+# TLS handshake per call; retries are left to call_gemini_with_schema
+client = genai.Client(
+    api_key=GEMINI_API_KEY,
+    http_options=types.HttpOptions(async_client_args={
+        "transport": httpx.AsyncHTTPTransport(
+            http2=True,
+            retries=0,
+            limits=httpx.Limits(max_connections=64, max_keepalive_connections=64),
+        ),
+    }),
+)
 GEMINI_MODEL = os.getenv("GEMINI_MODEL", "gemini-2.5-flash")
+# Token bucket shared by every request in the process
+LIMITER = AsyncLimiter(GEMINI_QPM, 60)
 
 STRICT_SUMMARY_SCHEMA = {
     "type": "object",
@@ -30,39 +85,49 @@ STRICT_SUMMARY_SCHEMA = {
     "required": ["summary", "fieldOfStudy"]
 }
 
-class GeminiStrictProcessor:
-    def __init__(self, model_name: str = GEMINI_MODEL):
-        self.model_name = model_name
-        self.client = client
-        print(f"🔧 GeminiStrictProcessor initialized with model: {self.model_name}")
-
-    def preprocess_source_text(self, source_data: Dict) -> Dict:
-        processed = source_data.copy()
-        text_parts = []
-
-        if source_data.get("hasAbstract") and source_data.get("abstract"):
-            text_parts.append(f"Abstract: {source_data['abstract']}")
-
-        if source_data.get("hasFullText") and source_data.get("fullText"):
-            full_text = source_data["fullText"]
-            if len(full_text) > 3000:
-                text_parts.append(f"Text Start: {full_text[:1500]}")
-                text_parts.append(f"Text End: {full_text[-1500:]}")
-            else:
-                text_parts.append(f"Full Text: {full_text}")
+# Several sources per request: an array of summaries keyed back by id
+BATCHED_SUMMARY_SCHEMA = {
+    "type": "array",
+    "items": {
+        "type": "object",
+        "properties": {
+            "id": {"type": "string"},
+            "summary": {"type": "string"},
+            "fieldOfStudy": {"type": "string"}
+        },
+        "required": ["id", "summary", "fieldOfStudy"]
+    }
+}
 
-        processed["processedText"] = "\n\n".join(text_parts)
-        processed.pop("fullText", None)
-        return processed
+# Failures and raw bad responses are handed to a background thread for the
+# file writes, so error-heavy runs don't block the event loop on disk I/O
+failure_log = logging.getLogger("process_sources.failures")
+failed_raw_log = logging.getLogger("process_sources.failed_raw")
+
+def start_queued_log(logger: logging.Logger, path: str, fmt: str) -> QueueListener:
+    log_queue = queue.SimpleQueue()
+    handler = logging.FileHandler(path, encoding="utf-8")
+    handler.setFormatter(logging.Formatter(fmt))
+    logger.addHandler(QueueHandler(log_queue))
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+    listener = QueueListener(log_queue, handler)
+    listener.start()
+    return listener
+
+# Compiled once for --strict-validate, keyed by the schema's top-level type
+STRICT_VALIDATORS = {
+    "object": Draft7Validator(STRICT_SUMMARY_SCHEMA),
+    "array": Draft7Validator(BATCHED_SUMMARY_SCHEMA),
+}
 
-    def build_prompt(self, processed_source: Dict) -> str:
-        essential_data = {
-            "processedText": processed_source.get("processedText", ""),
-            "detectedField": processed_source.get("detectedField", ""),
-            "searchStrategy": processed_source.get("searchStrategy", ""),
-        }
+def has_required_strings(parsed: Any, schema: Dict) -> bool:
+    """Cheap structural check of a response against one of the summary schemas."""
+    if schema["type"] == "array":
+        return isinstance(parsed, list) and all(has_required_strings(item, schema["items"]) for item in parsed)
+    return isinstance(parsed, dict) and all(isinstance(parsed.get(key), str) for key in schema["required"])
 
-        return f"""
+PROMPT_TEMPLATE = """
 You are a fast summarization assistant optimized for producing strict JSON for bulk ingestion.
 
 Use ONLY the 'processedText' (and optionally 'detectedField'/'searchStrategy').
@@ -78,69 +143,258 @@ Rules:
 - If you cannot find a field, return an empty string for it, but still output the JSON object.
 
 Input (use ONLY processedText + small metadata):
-{json.dumps(essential_data, indent=2)}
+{payload}
 """
 
-    def call_gemini_with_schema(self, prompt: str, max_retries: int = 3) -> Dict[str, Any]:
-        last_raw = None
-        for attempt in range(1, max_retries + 1):
-            try:
-                config = {
-                    "max_output_tokens": 400,
-                    "thinking_config": {"thinking_budget": 0},
-                    "response_mime_type": "application/json",
-                    "response_schema": STRICT_SUMMARY_SCHEMA
-                }
-
-                response = self.client.models.generate_content(
-                    model=self.model_name,
-                    contents=prompt,
-                    config=config
-                )
+BATCHED_PROMPT_TEMPLATE = """
+You are a fast summarization assistant optimized for producing strict JSON for bulk ingestion.
 
-                raw_text = getattr(response, "text", None)
-                if raw_text is None:
-                    out = getattr(response, "output", None)
-                    if out:
-                        parts = [p.get("text", "") for p in out if isinstance(p, dict)]
-                        raw_text = "\n".join(parts)
-                    else:
-                        raw_text = str(response)
-
-                last_raw = raw_text
-
-                try:
-                    parsed = json.loads(raw_text)
-                except Exception:
-                    parsed = self._extract_json_substring(raw_text)
-
-                validate(instance=parsed, schema=STRICT_SUMMARY_SCHEMA)
-                return parsed
-
-            except ValidationError as ve:
-                print(f"⚠️ Validation failed on attempt {attempt}/{max_retries}: {ve}")
-                print("Raw response (truncated):", (last_raw or "")[:1000])
-                if attempt < max_retries:
-                    prompt += "\n\nImportant: OUTPUT EXACTLY the JSON and NOTHING ELSE."
-                    time.sleep(1 + attempt)
-                    continue
-                else:
-                    self._save_failed_raw(last_raw)
-                    raise
+You are given {count} inputs. For EACH input, use ONLY its 'processedText' (and optionally 'detectedField').
 
-            except Exception as e:
-                print(f"⚠️ Gemini call error on attempt {attempt}/{max_retries}: {e}")
-                print("Raw response (truncated):", (last_raw or "")[:1000])
-                if attempt < max_retries:
-                    time.sleep(1 + attempt)
-                    continue
-                else:
-                    self._save_failed_raw(last_raw)
-                    raise
-
-        raise RuntimeError("Gemini response did not validate after retries")
-
-    def _extract_json_substring(self, txt: str) -> Dict[str, Any]:
+Return EXACTLY one JSON array with one object per input, conforming to this schema:
+[{{ "id": "...", "summary": "...", "fieldOfStudy": "..." }}, ...]
+
+Rules:
+- id: copy the input's id exactly.
+- summary: ~80 words (±15), one paragraph; include purpose, key methods (if present), main findings/claims, and keywords/entities useful for semantic search.
+- fieldOfStudy: cleaned detectedField (underscores -> spaces, capitalized) plus important keywords if present.
+- DO NOT include document type, geographical region, or language.
+- Output MUST be valid JSON only (no markdown fences, no commentary, no extra fields).
+- If you cannot find a field, return an empty string for it, but still output the object.
+
+Inputs:
+{payload}
+"""
+
+STRICT_OUTPUT_REMINDER = "\n\nImportant: OUTPUT EXACTLY the JSON and NOTHING ELSE."
+
+def normalize_full_text(texts: pa.Array) -> pa.Array:
+    """Drop trailing back matter and collapse whitespace before the text is sliced."""
+    # Headings are stripped from the last one backwards, stopping at the first
+    # half: theses often open with acknowledgements
+    half = pc.divide(pc.utf8_length(texts), 2)
+    while True:
+        lead = pc.replace_substring_regex(texts, pattern=BACK_MATTER_PATTERN, replacement=r"\1")
+        cut = pc.and_(pc.less(pc.utf8_length(lead), pc.utf8_length(texts)),
+                      pc.greater_equal(pc.add(pc.utf8_length(lead), 1), half))
+        if not pc.any(cut).as_py():
+            break
+        texts = pc.if_else(cut, lead, texts)
+    return pc.utf8_trim_whitespace(pc.replace_substring_regex(texts, pattern=WHITESPACE_PATTERN, replacement=" "))
+
+class Source(msgspec.Struct):
+    """One collected paper. Fields read here are typed; pass-through metadata is left as Any."""
+    id: Any = ""
+    paper_id: Optional[str] = ""
+    title: Optional[str] = ""
+    abstract: Optional[str] = None
+    hasAbstract: bool = False
+    authors: Any = None
+    yearPublished: Any = None
+    citationCount: Any = None
+    doi: Any = None
+    publisher: Any = None
+    documentType: Any = None
+    fieldOfStudy: Any = None
+    detectedField: Optional[str] = None
+    downloadUrl: Any = None
+    fullText: Optional[str] = None
+    fulltext_excerpt: Optional[str] = None
+    fulltext_head: Optional[str] = None
+    fulltext_tail: Optional[str] = None
+    hasFullText: bool = False
+    searchStrategy: Optional[str] = None
+    keywordUsed: Any = None
+    collectedAt: Any = None
+
+class ProcessedSource(msgspec.Struct):
+    """The slice of a source that goes into a prompt."""
+    id: Any
+    paper_id: Optional[str]
+    detectedField: Optional[str]
+    searchStrategy: Optional[str]
+    processedText: str
+
+# Input is a list of sources or a dict of per-field lists
+SOURCES_DECODER = msgspec.json.Decoder(Union[List[Source], Dict[str, List[Source]]])
+
+def first_line(exc: BaseException) -> str:
+    """First line of an exception's message, or its type name when the message is empty (e.g. timeouts)."""
+    return (str(exc).splitlines() or [type(exc).__name__])[0]
+
+def source_key(source: Union[Source, ProcessedSource]) -> str:
+    return str(source.id or source.paper_id)
+
+def to_api_schema(schema: Dict) -> Dict:
+    """Translate a JSON-schema dict into the REST Schema form (upper-case type enums)."""
+    out = dict(schema)
+    if "type" in out:
+        out["type"] = out["type"].upper()
+    if "properties" in out:
+        out["properties"] = {k: to_api_schema(v) for k, v in out["properties"].items()}
+    if "items" in out:
+        out["items"] = to_api_schema(out["items"])
+    return out
+
+# Converted once, keyed like STRICT_VALIDATORS: SDK Schema objects for live
+# requests and REST dicts for Batch API request lines
+RESPONSE_SCHEMAS = {
+    "object": types.Schema.model_validate(to_api_schema(STRICT_SUMMARY_SCHEMA)),
+    "array": types.Schema.model_validate(to_api_schema(BATCHED_SUMMARY_SCHEMA)),
+}
+BATCH_RESPONSE_SCHEMA = to_api_schema(STRICT_SUMMARY_SCHEMA)
+
+class GeminiStrictProcessor:
+    def __init__(self, model_name: str = GEMINI_MODEL, strict_validate: bool = False):
+        self.model_name = model_name
+        self.strict_validate = strict_validate
+        self.client = client
+        self.cache = Cache(CACHE_DIR)
+        print(f"🔧 GeminiStrictProcessor initialized with model: {self.model_name}")
+
+    def preprocess_sources(self, sources: List[Source]) -> List[ProcessedSource]:
+        """Build processedText for a chunk of sources as columns with Arrow kernels."""
+        abstracts = pa.array([
+            s.abstract if s.hasAbstract and s.abstract else None
+            for s in sources
+        ], pa.string())
+        # Older ingests persist the full body or a leading excerpt of it
+        full_texts = pa.array([
+            (s.fullText or s.fulltext_excerpt or None) if s.hasFullText else None
+            for s in sources
+        ], pa.string())
+
+        full_texts = normalize_full_text(full_texts)
+        body = pc.if_else(
+            pc.greater(pc.utf8_length(full_texts), 3000),
+            pc.binary_join_element_wise(
+                "Text Start: ", pc.utf8_slice_codeunits(full_texts, 0, 1500),
+                "\n\nText End: ", pc.utf8_slice_codeunits(full_texts, -1500), ""),
+            pc.binary_join_element_wise("Full Text: ", full_texts, ""),
+        )
+        # Newer ingests persist just the two ends, already normalized by
+        # ingest_coreapi.fulltext_edges; the tail is empty for short bodies
+        heads = pa.array([s.fulltext_head or None if s.hasFullText else None for s in sources], pa.string())
+        tails = pa.array([s.fulltext_tail or None if s.hasFullText else None for s in sources], pa.string())
+        body = pc.coalesce(
+            body,
+            pc.binary_join_element_wise("Text Start: ", heads, "\n\nText End: ", tails, ""),
+            pc.binary_join_element_wise("Full Text: ", heads, ""),
+        )
+        abstracts = pc.binary_join_element_wise("Abstract: ", abstracts, "")
+        # Both parts, else whichever one is present
+        texts = pc.coalesce(pc.binary_join_element_wise(abstracts, body, "\n\n"), abstracts, body, "")
+
+        return [
+            ProcessedSource(s.id, s.paper_id, s.detectedField, s.searchStrategy, text)
+            for s, text in zip(sources, texts.to_pylist())
+        ]
+
+    def build_prompt(self, processed_source: ProcessedSource) -> str:
+        essential_data = {
+            "processedText": processed_source.processedText,
+            "detectedField": processed_source.detectedField,
+            "searchStrategy": processed_source.searchStrategy,
+        }
+        return PROMPT_TEMPLATE.format(payload=orjson.dumps(essential_data, option=orjson.OPT_INDENT_2).decode())
+
+    def build_batched_prompt(self, processed_sources: List[ProcessedSource]) -> str:
+        inputs = [
+            {
+                "id": source_key(p),
+                "processedText": p.processedText,
+                "detectedField": p.detectedField,
+            }
+            for p in processed_sources
+        ]
+        return BATCHED_PROMPT_TEMPLATE.format(
+            count=len(inputs),
+            payload=orjson.dumps({"inputs": inputs}, option=orjson.OPT_INDENT_2).decode(),
+        )
+
+    async def call_gemini_with_schema(self, prompt: str, max_retries: int = MAX_RETRIES,
+                                      schema: Dict = STRICT_SUMMARY_SCHEMA,
+                                      max_output_tokens: int = OUTPUT_TOKENS_PER_SOURCE) -> Any:
+        config = {
+            "max_output_tokens": max_output_tokens,
+            "thinking_config": {"thinking_budget": 0},
+            "response_mime_type": "application/json",
+            "response_schema": RESPONSE_SCHEMAS[schema["type"]]
+        }
+        last_raw = None
+
+        def log_retry(retry_state):
+            # A failure in this hook would end the retries instead of being logged
+            try:
+                exc = retry_state.outcome.exception()
+                kind = "Validation failed" if isinstance(exc, ValidationError) else "Gemini call error"
+                failure_log.warning("%s on attempt %d/%d: %s, retrying in %.1f seconds; raw response (truncated): %s",
+                                    kind, retry_state.attempt_number, max_retries, first_line(exc),
+                                    retry_state.next_action.sleep, (last_raw or "")[:1000])
+            except Exception:
+                pass
+
+        # Randomized exponential backoff keeps concurrent tasks from retrying
+        # in lockstep after a burst of 429s
+        retrying = AsyncRetrying(
+            stop=stop_after_attempt(max_retries),
+            wait=wait_random_exponential(multiplier=1, max=60),
+            before_sleep=log_retry,
+            reraise=True,
+        )
+        try:
+            async for attempt in retrying:
+                with attempt:
+                    async with LIMITER:
+                        stream = await self.client.aio.models.generate_content_stream(
+                            model=self.model_name,
+                            contents=prompt,
+                            config=config
+                        )
+
+                    raw_text = await self._read_stream(stream)
+                    last_raw = raw_text
+
+                    try:
+                        parsed = orjson.loads(raw_text)
+                    except Exception:
+                        parsed = self._extract_json_substring(raw_text)
+
+                    try:
+                        self.check_response(parsed, schema)
+                    except ValidationError:
+                        if not prompt.endswith(STRICT_OUTPUT_REMINDER):
+                            prompt += STRICT_OUTPUT_REMINDER
+                        raise
+                    return parsed
+        except Exception as e:
+            failure_log.error("Gemini call failed after %d attempts: %s", max_retries, first_line(e))
+            self._save_failed_raw(last_raw)
+            raise
+
+    async def _read_stream(self, stream) -> str:
+        """Accumulate streamed text, failing on the first chunk that reports a block."""
+        parts = []
+        async for chunk in stream:
+            feedback = getattr(chunk, "prompt_feedback", None)
+            if feedback is not None and getattr(feedback, "block_reason", None):
+                raise RuntimeError(f"Prompt blocked: {feedback.block_reason}")
+            for candidate in getattr(chunk, "candidates", None) or []:
+                reason = getattr(candidate, "finish_reason", None)
+                if reason is not None and getattr(reason, "name", str(reason)) in STREAM_ABORT_REASONS:
+                    raise RuntimeError(f"Generation stopped: {getattr(reason, 'name', reason)}")
+            if getattr(chunk, "text", None):
+                parts.append(chunk.text)
+        return "".join(parts)
+
+    def check_response(self, parsed: Any, schema: Dict):
+        # Gemini already enforces response_schema; the full validator is for debugging
+        if self.strict_validate:
+            STRICT_VALIDATORS[schema["type"]].validate(parsed)
+        elif not has_required_strings(parsed, schema):
+            raise ValidationError(f"Response does not match the {schema['type']} summary schema")
+
+    def _extract_json_substring(self, txt: str) -> Any:
         cleaned = txt.strip()
         if cleaned.startswith("```json"):
             cleaned = cleaned[7:]
@@ -149,65 +403,399 @@ Input (use ONLY processedText + small metadata):
         if cleaned.endswith("```"):
             cleaned = cleaned[:-3]
         cleaned = cleaned.strip()
-        first = cleaned.find("{")
-        last = cleaned.rfind("}")
+        # Arrays for marshaled requests, objects for single ones
+        opener, closer = ("[", "]") if cleaned.find("[") != -1 and (
+            cleaned.find("{") == -1 or cleaned.find("[") < cleaned.find("{")) else ("{", "}")
+        first = cleaned.find(opener)
+        last = cleaned.rfind(closer)
         if first == -1 or last == -1 or last <= first:
             raise ValueError("No JSON object found in text")
-        return json.loads(cleaned[first:last + 1])
+        return orjson.loads(cleaned[first:last + 1])
 
     def _save_failed_raw(self, raw: str):
+        failed_raw_log.info(orjson.dumps({"raw": raw, "timestamp": time.time()}).decode())
+
+    def content_key(self, processed_source: ProcessedSource) -> str:
+        return hashlib.blake2b(processed_source.processedText.encode(), digest_size=16).hexdigest()
+
+    def cached_summary(self, processed_source: ProcessedSource) -> Dict:
+        return self.cache.get(self.content_key(processed_source))
+
+    def cache_summary(self, processed_source: ProcessedSource, parsed: Dict[str, Any]):
+        self.cache.set(self.content_key(processed_source), {
+            "summary": parsed.get("summary", ""),
+            "fieldOfStudy": parsed.get("fieldOfStudy", ""),
+        })
+
+    def build_final(self, source: Source, parsed: Dict[str, Any]) -> Dict:
+        summary = parsed.get("summary", "").strip()
+        field = parsed.get("fieldOfStudy", "").strip()
+        if not summary:
+            raise ValueError("Empty summary in validated response")
+
+        final = msgspec.structs.asdict(source)
+        final["summary"] = summary
+        final["fieldOfStudy"] = field
+        final.pop("fullText", None)
+        final.pop("fulltext_excerpt", None)
+        final.pop("fulltext_head", None)
+        final.pop("fulltext_tail", None)
+        final.pop("hasFullText", None)
+        return final
+
+    async def process_group(self, sources: List[Source], processed: List[ProcessedSource]) -> List[Dict]:
+        """Summarize several sources in one request; returns a result (or None) per source."""
+        # Identical text (re-runs, duplicate abstracts) is answered from the cache
+        cached = [self.cached_summary(p) for p in processed]
+        misses = [p for p, hit in zip(processed, cached) if hit is None]
+        by_id = {}
+        if misses:
+            prompt = self.build_batched_prompt(misses)
+            try:
+                parsed = await self.call_gemini_with_schema(
+                    prompt,
+                    schema=BATCHED_SUMMARY_SCHEMA,
+                    max_output_tokens=OUTPUT_TOKENS_PER_SOURCE * len(misses),
+                )
+            except Exception as e:
+                failure_log.exception("Failed to process group of %d sources: %s", len(misses), first_line(e))
+                parsed = []
+            by_id = {str(item.get("id")): item for item in parsed}
+
+        results = []
+        for source, processed_source, hit in zip(sources, processed, cached):
+            item = hit or by_id.get(source_key(source))
+            try:
+                if item is None:
+                    raise ValueError("Missing from marshaled response")
+                results.append(self.build_final(source, item))
+                if hit is None:
+                    self.cache_summary(processed_source, item)
+            except Exception as e:
+                failure_log.error("Failed to process source '%s': %s", source.title or "Unknown", e)
+                results.append(None)
+        return results
+
+def load_checkpoint() -> set:
+    processed_ids = set()
+    # Ids recorded by older runs as a single JSON array
+    if Path(LEGACY_CHECKPOINT_FILE).exists():
+        processed_ids.update(str(i) for i in orjson.loads(Path(LEGACY_CHECKPOINT_FILE).read_bytes()))
+    if Path(CHECKPOINT_FILE).exists():
+        processed_ids.update(line.decode() for line in Path(CHECKPOINT_FILE).read_bytes().splitlines() if line)
+    return processed_ids
+
+def mark_processed(checkpoint_log, processed_ids: set, keys: List[str]):
+    """Record ids whose results are already written; one appended line each."""
+    for key in keys:
+        processed_ids.add(key)
+        checkpoint_log.write(key.encode() + b"\n")
+    checkpoint_log.flush()
+
+def batch_files(output_dir: Path) -> List[Path]:
+    """Existing summaries_batch_N files (.jsonl, or legacy .json arrays) in batch order."""
+    files = [p for p in output_dir.glob("summaries_batch_*.json*")
+             if p.stem.rsplit("_", 1)[-1].isdigit()]
+    return sorted(files, key=lambda p: int(p.stem.rsplit("_", 1)[-1]))
+
+def iter_batch_bytes(batch_file: Path) -> Iterator[bytes]:
+    """Serialized records of one batch file; JSONL lines are passed through unparsed."""
+    with open(batch_file, "rb") as f:
+        if batch_file.suffix == ".jsonl":
+            for line in f:
+                line = line.strip()
+                if line:
+                    yield line
+        else:
+            for record in ijson.items(f, "item", use_float=True):
+                yield orjson.dumps(record)
+
+def merge_all_batches(output_dir: Path, final_file: Path):
+    # Streamed into one JSON array so only a single record is held at a time
+    with open(final_file, "wb") as f:
+        f.write(b"[")
+        sep = b"\n"
+        for batch_file in batch_files(output_dir):
+            for record in iter_batch_bytes(batch_file):
+                f.write(sep)
+                f.write(record)
+                sep = b",\n"
+        f.write(b"\n]\n")
+    print(f"✅ All batches merged into {final_file}")
+
+def iter_sources(input_path: Path) -> Iterator[Source]:
+    """Decode the input straight into Source structs, from a list or a dict of per-field lists."""
+    # Decoding from the mapped file avoids holding a second copy of its bytes
+    with open(input_path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
         try:
-            debug_path = Path("failed_raw_responses.jsonl")
-            with open(debug_path, "a", encoding="utf-8") as f:
-                record = {"raw": raw, "timestamp": time.time()}
-                f.write(json.dumps(record, ensure_ascii=False) + "\n")
-            print(f"🔖 Saved raw failed response to {debug_path}")
-        except Exception as e:
-            print("⚠️ Could not save failed raw response:", e)
+            decoded = SOURCES_DECODER.decode(m)
+        except msgspec.ValidationError as e:
+            raise RuntimeError(f"Unsupported input structure: {e}")
+    if isinstance(decoded, dict):
+        for lst in decoded.values():
+            yield from lst
+    else:
+        yield from decoded
+
+class BatchWriter:
+    """Appends results to summaries_batch_N.jsonl, rolling to a new file every BATCH_SIZE records."""
+
+    def __init__(self, output_dir: Path):
+        self.output_dir = output_dir
+        existing = batch_files(output_dir)
+        # Continue numbering after earlier runs instead of overwriting their batches
+        self.batch_count = int(existing[-1].stem.rsplit("_", 1)[-1]) + 1 if existing else 0
+        self.count = 0
+        self.path = None
+        self.file = None
+
+    def write(self, record: Dict) -> bool:
+        """Append one record; returns True when this completed a batch file."""
+        if self.file is None:
+            self.path = self.output_dir / f"summaries_batch_{self.batch_count}.jsonl"
+            self.file = open(self.path, "ab")
+        self.file.write(orjson.dumps(record, option=JSONL_OPTIONS))
+        self.count += 1
+        if self.count >= BATCH_SIZE:
+            self.close()
+            return True
+        return False
+
+    def flush(self):
+        if self.file is not None:
+            self.file.flush()
+
+    def close(self):
+        if self.file is None:
+            return
+        self.file.close()
+        print(f"🔖 Saved batch {self.batch_count} with {self.count} results to {self.path}")
+        self.file = None
+        self.count = 0
+        self.batch_count += 1
+
+def content_fingerprint(source: Source) -> bytes:
+    text = (source.abstract or "") + (source.fullText or source.fulltext_excerpt or source.fulltext_head or "")[:2000]
+    return hashlib.blake2b(text.encode(), digest_size=16).digest() if text else b""
+
+def pending_sources(sources: Iterable[Source], processed_ids: set) -> Iterator[Source]:
+    """Sources not yet checkpointed, first occurrence per id only.
+
+    A paper found under two fields keeps the same id in both; the baseline
+    skipped the second copy as soon as the first was processed.
+    """
+    seen = set()
+    for source in sources:
+        key = source_key(source)
+        if key in processed_ids or key in seen:
+            continue
+        seen.add(key)
+        yield source
+
+def dedupe_by_content(sources: Iterable[Source]):
+    """Split sources into ones to summarize and aliases keyed by the source they duplicate.
+
+    The same paper often comes back under different ids from different
+    keyword searches; only the first one seen is sent to Gemini.
+    """
+    dup_map: Dict[bytes, str] = {}
+    unique, aliases = [], {}
+    for source in sources:
+        fp = content_fingerprint(source)
+        # Sources with no text at all are never collapsed together
+        if fp and fp in dup_map:
+            # A repeat of the same id is dropped, not written again as a copy
+            if source_key(source) != dup_map[fp]:
+                aliases.setdefault(dup_map[fp], []).append(source)
+            continue
+        if fp:
+            dup_map[fp] = source_key(source)
+        unique.append(source)
+    if aliases:
+        print(f"🔁 {sum(map(len, aliases.values()))} duplicate sources will reuse another source's summary")
+    return unique, aliases
+
+def write_result(processor: GeminiStrictProcessor, writer: "BatchWriter", source: Source, final: Dict,
+                 aliases: Dict[str, List[Source]], done: List[str]):
+    """Write a source's result, copying it to every alias that shares its content."""
+    writer.write(final)
+    done.append(source_key(source))
+    for alias in aliases.pop(source_key(source), ()):
+        writer.write(processor.build_final(alias, final))
+        done.append(source_key(alias))
+
+def iter_preprocessed(processor: GeminiStrictProcessor, sources: Iterable[Source]) -> Iterator[tuple]:
+    """(source, processed) pairs, normalized PREPROCESS_CHUNK sources at a time."""
+    sources = iter(sources)
+    while chunk := list(islice(sources, PREPROCESS_CHUNK)):
+        yield from zip(chunk, processor.preprocess_sources(chunk))
+
+def group_sources(processor: GeminiStrictProcessor, sources: Iterable[Source]):
+    """Preprocess sources and pack them into groups for marshaled requests."""
+    group, processed_group, chars = [], [], 0
+    for source, processed in iter_preprocessed(processor, sources):
+        text_len = len(processed.processedText)
+        if group and (len(group) >= MARSHAL_SIZE or chars + text_len > MAX_MARSHAL_CHARS):
+            yield group, processed_group
+            group, processed_group, chars = [], [], 0
+        group.append(source)
+        processed_group.append(processed)
+        chars += text_len
+    if group:
+        yield group, processed_group
+
+async def process_all(processor: GeminiStrictProcessor, sources: Iterable[Source], processed_ids: set,
+                      checkpoint_log, output_dir: Path):
+    writer = BatchWriter(output_dir)
+
+    def collect(group: List[Source], outs: List[Dict]):
+        done = []
+        for source, out in zip(group, outs):
+            if out:
+                write_result(processor, writer, source, out, aliases, done)
+        # Results hit disk before their ids are checkpointed
+        writer.flush()
+        mark_processed(checkpoint_log, processed_ids, done)
+
+    async def run_group(group: List[Source], processed: List[ProcessedSource]):
+        return group, await processor.process_group(group, processed)
+
+    pending, aliases = dedupe_by_content(pending_sources(sources, processed_ids))
+
+    # The decoded sources are all in memory already; groups are preprocessed
+    # and dispatched as request slots free up, so at most MAX_CONCURRENCY
+    # requests are in flight
+    in_flight = set()
+    with tqdm(unit="source") as pbar:
+        for group, processed in group_sources(processor, pending):
+            in_flight.add(asyncio.create_task(run_group(group, processed)))
+            if len(in_flight) < MAX_CONCURRENCY:
+                continue
+            done, in_flight = await asyncio.wait(in_flight, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                group_done, outs = task.result()
+                pbar.update(len(group_done))
+                collect(group_done, outs)
+
+        for fut in asyncio.as_completed(in_flight):
+            group_done, outs = await fut
+            pbar.update(len(group_done))
+            collect(group_done, outs)
+
+    writer.close()
+
+def build_batch_request(processor: GeminiStrictProcessor, processed: ProcessedSource) -> Dict:
+    prompt = processor.build_prompt(processed)
+    return {
+        "key": source_key(processed),
+        "request": {
+            "contents": [{"role": "user", "parts": [{"text": prompt}]}],
+            "generation_config": {
+                "max_output_tokens": 400,
+                "thinking_config": {"thinking_budget": 0},
+                "response_mime_type": "application/json",
+                "response_schema": BATCH_RESPONSE_SCHEMA,
+            },
+        },
+    }
+
+def response_text(response: Dict) -> str:
+    candidates = response.get("candidates") or [{}]
+    parts = candidates[0].get("content", {}).get("parts", [])
+    return "".join(p.get("text", "") for p in parts)
+
+def run_batch_job(processor: GeminiStrictProcessor, sources: Iterable[Source], processed_ids: set,
+                  checkpoint_log, output_dir: Path):
+    """Summarize all pending sources through the Gemini Batch API.
+
+    Requests are submitted as one JSONL file and run server-side; the job is
+    polled until it finishes and results are matched back to sources by id.
+    """
+    writer = BatchWriter(output_dir)
+    done = []
+    pending = {}
+    cache_hits = 0
+    requests_file = output_dir / "batch_requests.jsonl"
+    unseen, aliases = dedupe_by_content(pending_sources(sources, processed_ids))
+    with open(requests_file, "wb") as f:
+        for source, processed in iter_preprocessed(processor, unseen):
+            key = source_key(source)
+            hit = processor.cached_summary(processed)
+            if hit is not None:
+                write_result(processor, writer, source, processor.build_final(source, hit), aliases, done)
+                cache_hits += 1
+                continue
+            pending[key] = (source, processed)
+            f.write(orjson.dumps(build_batch_request(processor, processed), option=JSONL_OPTIONS))
+
+    if cache_hits:
+        print(f"♻️ {cache_hits} sources answered from the summary cache")
+    # Checkpoint cached results now: the job below can fail or be interrupted
+    # during the long poll, and they must not be written again next run
+    writer.flush()
+    mark_processed(checkpoint_log, processed_ids, done)
+    done = []
+    if not pending:
+        writer.close()
+        print("Nothing to process.")
+        return
 
-    def process_source(self, source: Dict) -> Dict:
-        processed = self.preprocess_source_text(source)
-        prompt = self.build_prompt(processed)
+    uploaded = client.files.upload(
+        file=str(requests_file),
+        config=types.UploadFileConfig(display_name="debatecraft-summaries", mime_type="jsonl"),
+    )
+    job = client.batches.create(
+        model=processor.model_name,
+        src=uploaded.name,
+        config={"display_name": "debatecraft-summaries"},
+    )
+    print(f"🚀 Submitted batch job {job.name} with {len(pending)} requests")
+
+    while job.state.name not in BATCH_JOB_DONE_STATES:
+        time.sleep(BATCH_POLL_SECONDS)
+        job = client.batches.get(name=job.name)
+        print(f"⏳ Batch job state: {job.state.name}")
+
+    if job.state.name != "JOB_STATE_SUCCEEDED":
+        raise RuntimeError(f"Batch job {job.name} ended in state {job.state.name}")
+
+    content = client.files.download(file=job.dest.file_name)
+    for line in content.decode("utf-8").splitlines():
+        if not line.strip():
+            continue
+        record = orjson.loads(line)
+        if record.get("key") not in pending:
+            continue
+        source, processed = pending[record.get("key")]
+        raw_text = response_text(record.get("response") or {})
         try:
-            parsed = self.call_gemini_with_schema(prompt)
-            summary = parsed.get("summary", "").strip()
-            field = parsed.get("fieldOfStudy", "").strip()
-            if not summary:
-                raise ValueError("Empty summary in validated response")
-
-            final = source.copy()
-            final["summary"] = summary
-            final["fieldOfStudy"] = field
-            final["id"] = source.get("id", "")
-            final["paper_id"] = source.get("paper_id", "")
-            final.pop("fullText", None)
-            final.pop("hasFullText", None)
-            return final
+            parsed = orjson.loads(raw_text)
+            processor.check_response(parsed, STRICT_SUMMARY_SCHEMA)
+            write_result(processor, writer, source, processor.build_final(source, parsed), aliases, done)
+            processor.cache_summary(processed, parsed)
         except Exception as e:
-            print(f"❌ Failed to process source '{source.get('title','Unknown')}': {e}")
-            traceback.print_exc()
-            return None
-
-def save_checkpoint(processed_ids: List[str]):
-    with open(CHECKPOINT_FILE, "w", encoding="utf-8") as f:
-        json.dump(processed_ids, f, indent=2)
+            failure_log.error("Failed to process source '%s': %s", source.title or "Unknown", e)
+            processor._save_failed_raw(raw_text or orjson.dumps(record.get("error")).decode())
 
-def load_checkpoint() -> List[str]:
-    if Path(CHECKPOINT_FILE).exists():
-        with open(CHECKPOINT_FILE, "r", encoding="utf-8") as f:
-            return json.load(f)
-    return []
+    writer.close()
+    mark_processed(checkpoint_log, processed_ids, done)
 
-def merge_all_batches(output_dir: Path, final_file: Path):
-    merged = []
-    for batch_file in sorted(output_dir.glob("summaries_batch_*.json")):
-        with open(batch_file, "r", encoding="utf-8") as f:
-            merged.extend(json.load(f))
-    with open(final_file, "w", encoding="utf-8") as f:
-        json.dump(merged, f, indent=2, ensure_ascii=False)
-    print(f"✅ All batches merged into {final_file}")
+def run_async(coro):
+    """asyncio.run on uvloop, or on the selector loop on Windows."""
+    if sys.platform == "win32":
+        asyncio.set_event_loop_policy(asyncio.WindowsSelectorEventLoopPolicy())
+        return asyncio.run(coro)
+    return uvloop.run(coro)
 
 def main():
+    parser = argparse.ArgumentParser(description="Summarize debate sources with Gemini")
+    parser.add_argument("--mode", choices=["live", "batch"], default="live",
+                        help="live: concurrent per-source calls (good for small runs); "
+                             "batch: Gemini Batch API job (cheaper, for bulk runs)")
+    parser.add_argument("--strict-validate", action="store_true",
+                        help="run full JSON Schema validation on every response (debugging)")
+    args = parser.parse_args()
+
     BASE_DIR = Path(__file__).resolve().parent
     APP_DIR = BASE_DIR.parent
     PROJECT_ROOT = APP_DIR.parent
@@ -227,51 +815,25 @@ def main():
 
     print("Using input file:", str(input_path))
 
-    with open(input_path, "r", encoding="utf-8") as f:
-        data = json.load(f)
-
-    all_sources: List[Dict] = []
-    if isinstance(data, dict):
-        for _, lst in data.items():
-            if isinstance(lst, list):
-                all_sources.extend(lst)
-    elif isinstance(data, list):
-        all_sources = data
-    else:
-        raise RuntimeError("Unsupported input top-level type")
-
-    processed_ids = set(load_checkpoint())
-    processor = GeminiStrictProcessor()
-    results_batch = []
-    batch_count = 0
+    all_sources = iter_sources(input_path)
 
-    for source in tqdm(all_sources):
-        source_id = source.get("id") or source.get("paper_id")
-        if source_id in processed_ids:
-            continue
-
-        out = processor.process_source(source)
-        if out:
-            results_batch.append(out)
-            processed_ids.add(source_id)
-
-        if len(results_batch) >= BATCH_SIZE:
-            batch_file = input_path.parent / f"summaries_batch_{batch_count}.json"
-            with open(batch_file, "w", encoding="utf-8") as f:
-                json.dump(results_batch, f, indent=2, ensure_ascii=False)
-            print(f"🔖 Saved batch {batch_count} with {len(results_batch)} results to {batch_file}")
-            results_batch = []
-            batch_count += 1
-            save_checkpoint(list(processed_ids))
-
-        time.sleep(1)
-
-    if results_batch:
-        batch_file = input_path.parent / f"summaries_batch_{batch_count}.json"
-        with open(batch_file, "w", encoding="utf-8") as f:
-            json.dump(results_batch, f, indent=2, ensure_ascii=False)
-        print(f"🔖 Saved final batch {batch_count} with {len(results_batch)} results to {batch_file}")
-        save_checkpoint(list(processed_ids))
+    listeners = [
+        start_queued_log(failure_log, FAILURE_LOG_FILE, "%(asctime)s %(levelname)s %(message)s"),
+        start_queued_log(failed_raw_log, FAILED_RAW_FILE, "%(message)s"),
+    ]
+    print(f"📝 Failures are logged to {FAILURE_LOG_FILE}, raw bad responses to {FAILED_RAW_FILE}")
+
+    processed_ids = load_checkpoint()
+    processor = GeminiStrictProcessor(strict_validate=args.strict_validate)
+    try:
+        with open(CHECKPOINT_FILE, "ab") as checkpoint_log:
+            if args.mode == "batch":
+                run_batch_job(processor, all_sources, processed_ids, checkpoint_log, input_path.parent)
+            else:
+                run_async(process_all(processor, all_sources, processed_ids, checkpoint_log, input_path.parent))
+    finally:
+        for listener in listeners:
+            listener.stop()
 
     # Merge all batches
     final_file = input_path.parent / "summaries_all.json"